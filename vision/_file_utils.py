@@ -29,8 +29,11 @@ def get_files_from_dir(dir_path: str, file_type: str = None) -> List[str]:
     return file_paths
 
 
+_LEADING_INT_PATTERN = re.compile("[0-9]+")
+
+
 def _int_string_sort(file_name) -> int:
-    match = re.match("[0-9]+", os.path.basename(file_name))
+    match = _LEADING_INT_PATTERN.match(os.path.basename(file_name))
     if not match:
         return 0
     return int(match[0])
@@ -39,21 +42,26 @@ def _int_string_sort(file_name) -> int:
 def get_highest_numbered_file(
     dir_path: str, file_type: str = None, filter_keyword=None
 ) -> str:
-    file_names = get_files_from_dir(dir_path)
-
-    if file_type is not None:
-        file_names = [
-            file_name
-            for file_name in file_names
-            if file_name.lower().endswith(file_type.lower())
-        ]
-    if filter_keyword is not None:
-        file_names = [
-            file_name
-            for file_name in file_names
-            if filter_keyword.lower() in file_name.lower()
-        ]
-    if len(file_names) == 0:
+    if not os.path.isdir(dir_path):
         return None
-    highest_numbered_file = sorted(file_names, key=_int_string_sort, reverse=True)[0]
-    return os.path.join(dir_path, highest_numbered_file)
+    file_type = file_type.lower() if file_type is not None else None
+    filter_keyword = filter_keyword.lower() if filter_keyword is not None else None
+
+    highest_number = None
+    highest_numbered_file = None
+    # scandir provides the file type with the directory listing, avoiding a
+    # separate stat call per file
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            file_name = entry.name.lower()
+            if file_type is not None and not file_name.endswith(file_type):
+                continue
+            if filter_keyword is not None and filter_keyword not in file_name:
+                continue
+            if not entry.is_file():
+                continue
+            number = _int_string_sort(entry.name)
+            if highest_number is None or number > highest_number:
+                highest_number = number
+                highest_numbered_file = entry.path
+    return highest_numbered_file
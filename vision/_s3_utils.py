@@ -1,14 +1,65 @@
+from concurrent.futures import ThreadPoolExecutor
 import os
 import pathlib
 import re
+import threading
 from typing import List
 
 import boto3
+from boto3.s3.transfer import TransferConfig
 import botocore
+import botocore.config
+
+# Number of objects to transfer concurrently, across all calls
+MAX_CONCURRENT_TRANSFERS = 16
+# Number of threads used for the ranged parts of each large object
+MAX_CONCURRENT_PARTS_PER_TRANSFER = 4
+
+_TRANSFER_CONFIG = TransferConfig(max_concurrency=MAX_CONCURRENT_PARTS_PER_TRANSFER)
+
+# Enough connections for every transfer thread, plus the calls made alongside
+# them such as listing directories and checking whether objects exist
+_MAX_POOL_CONNECTIONS = (
+    MAX_CONCURRENT_TRANSFERS * MAX_CONCURRENT_PARTS_PER_TRANSFER
+    + MAX_CONCURRENT_TRANSFERS
+)
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+_transfer_executor = None
+_transfer_executor_lock = threading.Lock()
+
+
+def _get_s3_client():
+    # boto3 clients are thread safe, so one is shared by all calls and threads to
+    # avoid setting up a connection and credentials for every request
+    global _s3_client  # pylint: disable=global-statement
+    with _s3_client_lock:
+        if _s3_client is None:
+            _s3_client = boto3.session.Session().client(
+                "s3",
+                config=botocore.config.Config(
+                    max_pool_connections=_MAX_POOL_CONNECTIONS
+                ),
+            )
+        return _s3_client
+
+
+def _get_transfer_executor() -> ThreadPoolExecutor:
+    # one pool shared by all transfers, so syncing several directories at once
+    # does not multiply the number of concurrent transfers
+    global _transfer_executor  # pylint: disable=global-statement
+    with _transfer_executor_lock:
+        if _transfer_executor is None:
+            _transfer_executor = ThreadPoolExecutor(
+                max_workers=MAX_CONCURRENT_TRANSFERS
+            )
+        return _transfer_executor
 
 
 def s3_bucket_exists(name: str) -> bool:
-    s3 = boto3.client("s3")
+    s3 = _get_s3_client()
     try:
         s3.head_bucket(Bucket=name)
     except botocore.exceptions.ClientError as e:
@@ -18,9 +69,9 @@ def s3_bucket_exists(name: str) -> bool:
 
 
 def s3_file_exists(bucket_name: str, s3_object_path: str) -> None:
-    s3 = boto3.resource("s3")
+    s3 = _get_s3_client()
     try:
-        s3.Object(bucket_name, s3_object_path).load()  # pylint: disable=no-member
+        s3.head_object(Bucket=bucket_name, Key=s3_object_path)
     except botocore.exceptions.ClientError as e:
         if e.response["Error"]["Code"] == "404":
             return False
@@ -33,7 +84,8 @@ def s3_file_exists(bucket_name: str, s3_object_path: str) -> None:
 def s3_get_object_names_from_dir(
     bucket_name: str, dir_name: str, file_type: str = None
 ) -> List[str]:
-    s3 = boto3.resource("s3")
+    # a session per call so directories can be listed from several threads
+    s3 = boto3.session.Session().resource("s3")
     bucket = s3.Bucket(bucket_name)  # pylint: disable=no-member
     object_names = [
         object_summary.key for object_summary in bucket.objects.filter(Prefix=dir_name)
@@ -51,12 +103,9 @@ def s3_get_object_names_from_dir(
 def s3_download_files(
     bucket_name: str, s3_object_paths: List[str], destination_dir: str
 ) -> None:
-    s3_client = boto3.client("s3")
-    s3_resource = boto3.resource("s3")
-    object_summary_list = [
-        s3_resource.ObjectSummary(  # pylint: disable=no-member
-            bucket_name, s3_object_path
-        )
+    s3_client = _get_s3_client()
+    s3_object_paths = [
+        s3_object_path
         for s3_object_path in s3_object_paths
         if not os.path.isfile(
             os.path.join(destination_dir, os.path.basename(s3_object_path))
@@ -66,26 +115,27 @@ def s3_download_files(
     if not os.path.isdir(destination_dir):
         pathlib.Path(destination_dir).mkdir(parents=True, exist_ok=True)
 
-    for object_index, object_summary in enumerate(object_summary_list):
-
+    def download_object(object_index, s3_object_path):
         print(
             "Downloading file from %s:%s, %i/%i"
-            % (
-                object_summary.bucket_name,
-                object_summary.key,
-                object_index + 1,
-                len(object_summary_list),
-            )
+            % (bucket_name, s3_object_path, object_index + 1, len(s3_object_paths))
         )
         try:
-            s3_client.download_file(  # pylint: disable=no-member
-                object_summary.bucket_name,
-                object_summary.key,
-                os.path.join(destination_dir, os.path.basename(object_summary.key)),
+            s3_client.download_file(
+                bucket_name,
+                s3_object_path,
+                os.path.join(destination_dir, os.path.basename(s3_object_path)),
+                Config=_TRANSFER_CONFIG,
             )
         except botocore.exceptions.ClientError as e:
             print(e)
 
+    list(
+        _get_transfer_executor().map(
+            download_object, range(len(s3_object_paths)), s3_object_paths
+        )
+    )
+
 
 def s3_download_dir(
     s3_bucket_name: str, s3_dir_path: str, local_dir_path, file_type: str = None,
@@ -98,8 +148,11 @@ def s3_download_dir(
     )
 
 
+_LEADING_INT_PATTERN = re.compile("[0-9]+")
+
+
 def _int_string_sort(file_name) -> int:
-    match = re.match("[0-9]+", os.path.basename(file_name))
+    match = _LEADING_INT_PATTERN.match(os.path.basename(file_name))
     if not match:
         return 0
     return int(match[0])
@@ -136,8 +189,9 @@ def s3_upload_files(
     s3_destination_object_dir: str,
     notify_if_exists: bool = False,
 ) -> None:
-    s3 = boto3.client("s3")
-    for file_index, file_to_send in enumerate(files_to_send):
+    s3 = _get_s3_client()
+
+    def upload_file(file_index, file_to_send):
         s3_destination_object_path = "/".join(
             [s3_destination_object_dir, os.path.basename(file_to_send)]
         )
@@ -153,7 +207,7 @@ def s3_upload_files(
                             len(files_to_send),
                         )
                     )
-                continue
+                return
             print(
                 "Uploading file to %s:%s, %i/%i"
                 % (
@@ -163,8 +217,17 @@ def s3_upload_files(
                     len(files_to_send),
                 )
             )
-            s3.upload_file(file_to_send, bucket_name, s3_destination_object_path)
+            s3.upload_file(
+                file_to_send,
+                bucket_name,
+                s3_destination_object_path,
+                Config=_TRANSFER_CONFIG,
+            )
         except botocore.exceptions.ClientError as e:
             print(e)
-            continue
 
+    list(
+        _get_transfer_executor().map(
+            upload_file, range(len(files_to_send)), files_to_send
+        )
+    )
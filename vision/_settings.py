@@ -9,6 +9,7 @@ ANNOTATION_DIR_NAME = "annotations"
 MANIFEST_DIR_NAME = "manifests"
 MODEL_STATE_DIR_NAME = "modelstates"
 LOGS_DIR_NAME = "logs"
+IMAGE_CACHE_DIR_NAME = "cache"
 
 IMAGE_FILE_TYPE = "jpg"
 ANNOTATION_FILE_TYPE = "xml"
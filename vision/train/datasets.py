@@ -1,14 +1,79 @@
+import json
 import os
+from pathlib import Path
 from typing import List
 
+import numpy as np
 from PIL import Image
 import torch
 
-from .pascal_voc_parser import read_content, has_boxes
+from .pascal_voc_parser import read_content
 
 
 INVALID_ANNOTATION_FILE_IDENTIFIER = "invalid"
 
+IMAGE_CACHE_FILE_TYPE = "npy"
+IMAGE_CACHE_INDEX_FILE_TYPE = "json"
+
+
+def _image_cache_index_path(cache_file_path: str) -> str:
+    return "%s.%s" % (os.path.splitext(cache_file_path)[0], IMAGE_CACHE_INDEX_FILE_TYPE)
+
+
+def _remove_stale_image_caches(cache_file_path: str) -> None:
+    # each cache is a full decoded copy of the dataset, only keep the current one
+    cache_dir_path = os.path.dirname(cache_file_path)
+    keep = {
+        os.path.basename(cache_file_path),
+        os.path.basename(_image_cache_index_path(cache_file_path)),
+    }
+    for file_name in os.listdir(cache_dir_path):
+        if file_name in keep:
+            continue
+        if file_name.endswith(
+            (".%s" % IMAGE_CACHE_FILE_TYPE, ".%s" % IMAGE_CACHE_INDEX_FILE_TYPE)
+        ):
+            print("Removing stale image cache file %s" % file_name)
+            os.remove(os.path.join(cache_dir_path, file_name))
+
+
+def create_image_cache(image_paths: List[str], cache_file_path: str) -> None:
+    """Decode the given images into one flat uint8 file that can be memory
+    mapped, along with an index of each image's offset and shape.
+    """
+    _remove_stale_image_caches(cache_file_path)
+
+    index_file_path = _image_cache_index_path(cache_file_path)
+    if os.path.isfile(cache_file_path) and os.path.isfile(index_file_path):
+        return
+
+    image_paths = list(dict.fromkeys(image_paths))
+
+    # Image sizes can be read from the headers without decoding
+    index = {}
+    offset = 0
+    for image_path in image_paths:
+        with Image.open(image_path) as img:
+            width, height = img.size
+        index[os.path.basename(image_path)] = [offset, height, width]
+        offset += height * width * 3
+
+    print("Caching %d decoded images in %s" % (len(index), cache_file_path))
+
+    cache = np.lib.format.open_memmap(
+        cache_file_path, mode="w+", dtype=np.uint8, shape=(max(offset, 1),)
+    )
+    for image_path in image_paths:
+        start, height, width = index[os.path.basename(image_path)]
+        img = Image.open(image_path).convert("RGB")
+        cache[start : start + height * width * 3] = np.asarray(img).reshape(-1)
+    cache.flush()
+    del cache
+
+    # Written last so that an interrupted run does not leave a usable cache
+    with open(index_file_path, "w") as index_file:
+        json.dump(index, index_file)
+
 
 class BojaDataSet(object):
     def __init__(
@@ -22,36 +87,95 @@ class BojaDataSet(object):
         self.image_dir_path = image_dir_path
         self.annotation_dir_path = annotation_dir_path
 
+        self.image_cache_path = None
+        self.image_cache_index = None
+        # opened lazily so each data loader worker maps the file itself
+        self._image_cache = None
+
         self.transforms = transforms
 
         self.labels = labels
+        # map label names to class indices for constant time lookups per box
+        self.label_indices = {label: i for i, label in enumerate(labels)}
         manifest_items = [
-            item.strip() for item in open(manifest_file_path).read().splitlines()
+            item.strip().split(",")
+            for item in Path(manifest_file_path).read_text().splitlines()
         ]
-        # Filter out Invalid images and annotations with no bounding boxes, ensure files exist
         manifest_items = [
-            item
-            for item in manifest_items
-            if os.path.isfile(os.path.join(self.image_dir_path, item.split(",")[0]))
-            and os.path.isfile(
-                os.path.join(self.annotation_dir_path, item.split(",")[1])
+            (
+                os.path.join(self.image_dir_path, item[0]),
+                os.path.join(self.annotation_dir_path, item[1]),
+                item[1],
             )
-            and item.split(",")[1].lower() != INVALID_ANNOTATION_FILE_IDENTIFIER
-            and has_boxes(os.path.join(self.annotation_dir_path, item.split(",")[1]))
-        ]
-
-        self.images = [
-            os.path.join(self.image_dir_path, item.split(",")[0])
             for item in manifest_items
+            # skip blank and malformed lines
+            if len(item) >= 2
         ]
-        self.annotations = [
-            os.path.join(self.annotation_dir_path, item.split(",")[1])
-            for item in manifest_items
+        # Filter out Invalid images and annotations, ensure files exist
+        manifest_items = [
+            (image_path, annotation_path)
+            for image_path, annotation_path, annotation_name in manifest_items
+            if os.path.isfile(image_path)
+            and os.path.isfile(annotation_path)
+            and annotation_name.lower() != INVALID_ANNOTATION_FILE_IDENTIFIER
         ]
-
-    def __getitem__(self, idx):
+        # Parse each annotation once, keeping its class indices and filtering out
+        # annotations with no bounding boxes
+        manifest_items = [
+            (
+                image_path,
+                annotation_path,
+                [self.label_indices[b.label] for b in read_content(annotation_path)[1]],
+            )
+            for image_path, annotation_path in manifest_items
+        ]
+        manifest_items = [item for item in manifest_items if len(item[2]) > 0]
+
+        self.images = [image_path for image_path, _, _ in manifest_items]
+        self.annotations = [annotation_path for _, annotation_path, _ in manifest_items]
+        self.image_labels = [image_labels for _, _, image_labels in manifest_items]
+
+    def set_image_cache(self, image_cache_path: str) -> None:
+        """Load images from a cache created by create_image_cache."""
+        with open(_image_cache_index_path(image_cache_path)) as index_file:
+            self.image_cache_index = json.load(index_file)
+        self.image_cache_path = image_cache_path
+        self._image_cache = None
+
+    def _load_image(self, idx):
+        image_name = os.path.basename(self.images[idx])
+        if self.image_cache_index is None or image_name not in self.image_cache_index:
+            return Image.open(self.images[idx]).convert("RGB")
+        if self._image_cache is None:
+            self._image_cache = np.load(self.image_cache_path, mmap_mode="r")
+        start, height, width = self.image_cache_index[image_name]
+        pixels = self._image_cache[start : start + height * width * 3]
+        return Image.fromarray(pixels.reshape(height, width, 3))
+
+    def get_labels(self, idx) -> List[int]:
+        """Return the class indices of the boxes in the image at idx without
+        loading the image or its annotation.
+        """
+        return self.image_labels[idx]
+
+    def get_image_size(self, idx):
+        """Return the (width, height) of the image at idx without decoding it."""
+        image_name = os.path.basename(self.images[idx])
+        if self.image_cache_index is not None and image_name in self.image_cache_index:
+            _, height, width = self.image_cache_index[image_name]
+            return width, height
+        with Image.open(self.images[idx]) as img:
+            return img.size
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_image_cache"] = None
+        return state
+
+    def get_raw(self, idx):
+        """Return the image and target at idx without applying the transforms."""
         # load images ad masks
-        img = Image.open(self.images[idx]).convert("RGB")
+        img = self._load_image(idx)
         _, annotation_boxes = read_content(self.annotations[idx])
 
         num_objs = len(annotation_boxes)
@@ -59,7 +183,7 @@ class BojaDataSet(object):
         boxes = torch.as_tensor(boxes, dtype=torch.float32)
         # there is only one class
 
-        labels = [self.labels.index(b.label) for b in annotation_boxes]
+        labels = [self.label_indices[b.label] for b in annotation_boxes]
         labels = torch.as_tensor(labels, dtype=torch.int64)
 
         image_id = torch.tensor([idx])  # pylint: disable=not-callable
@@ -77,6 +201,11 @@ class BojaDataSet(object):
         target["area"] = area
         target["iscrowd"] = iscrowd
 
+        return img, target
+
+    def __getitem__(self, idx):
+        img, target = self.get_raw(idx)
+
         if self.transforms is not None:
             img, target = self.transforms(img, target)
 
@@ -84,3 +213,25 @@ class BojaDataSet(object):
 
     def __len__(self):
         return len(self.images)
+
+
+class TransformedSubset(torch.utils.data.Dataset):
+    """A subset of a BojaDataSet with its own transforms, so that several subsets
+    can share one loaded dataset.
+    """
+
+    def __init__(self, dataset: BojaDataSet, indices: List[int], transforms):
+        self.dataset = dataset
+        self.indices = indices
+        self.transforms = transforms
+
+    def __getitem__(self, idx):
+        img, target = self.dataset.get_raw(self.indices[idx])
+
+        if self.transforms is not None:
+            img, target = self.transforms(img, target)
+
+        return img, target
+
+    def __len__(self):
+        return len(self.indices)
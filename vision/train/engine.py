@@ -1,4 +1,5 @@
 # Copied from https://github.com/pytorch/vision/tree/master/references/detection
+import contextlib
 import math
 import sys
 import time
@@ -8,10 +9,37 @@ import torchvision.models.detection.mask_rcnn
 
 from .coco_utils import get_coco_api_from_dataset
 from .coco_eval import CocoEvaluator
-from .train_utils import SmoothedValue, MetricLogger, warmup_lr_scheduler, reduce_dict
-
-
-def train_one_epoch(model, optimizer, data_loader, device, epoch, print_freq):
+from .train_utils import (
+    SmoothedValue,
+    MetricLogger,
+    warmup_lr_scheduler,
+    reduce_dict,
+    DetectionBatch,
+)
+
+
+def _batch_to_device(batch, device):
+    if isinstance(batch, DetectionBatch):
+        return batch.to_device_lists(device, non_blocking=True)
+    images, targets = batch
+    images = list(image.to(device, non_blocking=True) for image in images)
+    targets = [
+        {k: v.to(device, non_blocking=True) for k, v in t.items()} for t in targets
+    ]
+    return images, targets
+
+
+def train_one_epoch(
+    model,
+    optimizer,
+    data_loader,
+    device,
+    epoch,
+    print_freq,
+    amp_dtype=None,
+    scaler=None,
+    set_grads_to_none=False,
+):
     model.train()
     metric_logger = MetricLogger(delimiter="  ")
     metric_logger.add_meter("lr", SmoothedValue(window_size=1, fmt="{value:.6f}"))
@@ -24,13 +52,19 @@ def train_one_epoch(model, optimizer, data_loader, device, epoch, print_freq):
 
         lr_scheduler = warmup_lr_scheduler(optimizer, warmup_iters, warmup_factor)
 
-    for images, targets in metric_logger.log_every(data_loader, print_freq, header):
-        images = list(image.to(device) for image in images)
-        targets = [{k: v.to(device) for k, v in t.items()} for t in targets]
+    for batch in metric_logger.log_every(data_loader, print_freq, header):
+        images, targets = _batch_to_device(batch, device)
 
-        loss_dict = model(images, targets)
+        # run the forward pass in mixed precision when an amp dtype is given
+        autocast = (
+            torch.autocast(device_type=device.type, dtype=amp_dtype)
+            if amp_dtype is not None
+            else contextlib.ExitStack()
+        )
+        with autocast:
+            loss_dict = model(images, targets)
 
-        losses = sum(loss for loss in loss_dict.values())
+            losses = sum(loss for loss in loss_dict.values())
 
         # reduce losses over all GPUs for logging purposes
         loss_dict_reduced = reduce_dict(loss_dict)
@@ -43,9 +77,17 @@ def train_one_epoch(model, optimizer, data_loader, device, epoch, print_freq):
             print(loss_dict_reduced)
             sys.exit(1)
 
-        optimizer.zero_grad()
-        losses.backward()
-        optimizer.step()
+        if set_grads_to_none:
+            optimizer.zero_grad(set_to_none=True)
+        else:
+            optimizer.zero_grad()
+        if scaler is not None:
+            scaler.scale(losses).backward()
+            scaler.step(optimizer)
+            scaler.update()
+        else:
+            losses.backward()
+            optimizer.step()
 
         if lr_scheduler is not None:
             lr_scheduler.step()
@@ -80,9 +122,8 @@ def evaluate(model, data_loader, device):
     iou_types = _get_iou_types(model)
     coco_evaluator = CocoEvaluator(coco, iou_types)
 
-    for image, targets in metric_logger.log_every(data_loader, 100, header):
-        image = list(img.to(device) for img in image)
-        targets = [{k: v.to(device) for k, v in t.items()} for t in targets]
+    for batch in metric_logger.log_every(data_loader, 100, header):
+        image, targets = _batch_to_device(batch, device)
 
         if device == torch.device("cuda"):
             torch.cuda.synchronize()
@@ -1,18 +1,26 @@
 # Based on sample code from the TorchVision 0.3 Object Detection Finetuning Tutorial
 # http://pytorch.org/tutorials/intermediate/torchvision_tutorial.html
 
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import inspect
 import os
+from pathlib import Path
 import time
-from typing import List
-import re
+from typing import List, Tuple
 
 from absl import app, flags
-import matplotlib
-import matplotlib.pyplot as plt
+import numpy as np
 import torch
 
-from .datasets import BojaDataSet
+from .datasets import (
+    BojaDataSet,
+    TransformedSubset,
+    create_image_cache,
+    IMAGE_CACHE_FILE_TYPE,
+)
 from .engine import train_one_epoch, evaluate
+from .group_by_aspect_ratio import GroupedBatchSampler, create_aspect_ratio_groups
 from .._file_utils import create_output_dir, get_highest_numbered_file
 from .. import _models
 from .._s3_utils import (
@@ -21,7 +29,7 @@ from .._s3_utils import (
     s3_download_dir,
 )
 from .transforms import ToTensor, RandomHorizontalFlip, Compose
-from .train_utils import collate_fn
+from .train_utils import collate_detection_batch, PrefetchDataLoader
 from .._settings import (
     DEFAULT_LOCAL_DATA_DIR,
     DEFAULT_S3_DATA_DIR,
@@ -35,12 +43,10 @@ from .._settings import (
     MODEL_STATE_FILE_TYPE,
     LABEL_FILE_NAME,
     LOGS_DIR_NAME,
-    INVALID_ANNOTATION_FILE_IDENTIFIER,
+    IMAGE_CACHE_DIR_NAME,
     NETWORKS,
 )
 
-matplotlib.use("Agg")
-
 AVERAGE_PRECISION_STAT_INDEX = 0
 AVERAGE_RECALL_STAT_INDEX = 8
 
@@ -61,9 +67,45 @@ flags.DEFINE_enum(
     "network", NETWORKS[0], NETWORKS, "The neural network to use for object detection",
 )
 flags.DEFINE_integer("num_epochs", 10, "The number of epochs to train the model for.")
+flags.DEFINE_integer("batch_size", 4, "The number of images per training batch.")
+flags.DEFINE_integer(
+    "aspect_ratio_group_factor",
+    3,
+    "Batch training images with similar aspect ratios together. Set to -1 to disable.",
+)
+
+flags.DEFINE_enum(
+    "amp_dtype",
+    None,
+    ["bf16", "fp16", "fp32"],
+    "The precision to train in on a GPU. Default is bf16 on GPUs that support it, "
+    "otherwise fp16.",
+)
+
+flags.DEFINE_bool(
+    "compile_model",
+    False,
+    "Compile the model with torch.compile before training. Speeds up each epoch "
+    "at the cost of a slower first epoch.",
+)
+
+flags.DEFINE_bool(
+    "cache_images",
+    False,
+    "Decode the manifest's images once into a memory mapped cache file to speed up "
+    "data loading. The cache uses considerably more disk space than the images.",
+)
+
+flags.DEFINE_integer(
+    "num_workers",
+    None,
+    "The number of data loading worker processes. Default is based on the CPU count.",
+)
 
 
 def get_transform(train):
+    # Images reach the transforms as PIL images, decoding them is the main cost of
+    # loading a sample. Installing Pillow-SIMD speeds this up without code changes.
     transforms = []
     transforms.append(ToTensor())
     if train:
@@ -71,6 +113,184 @@ def get_transform(train):
     return Compose(transforms)
 
 
+def get_num_workers() -> int:
+    if flags.FLAGS.num_workers is not None:
+        return flags.FLAGS.num_workers
+    # worker processes only pay off when they can feed a GPU
+    if not torch.cuda.is_available():
+        return 0
+    if hasattr(os, "sched_getaffinity"):
+        cpu_count = len(os.sched_getaffinity(0))
+    else:
+        cpu_count = os.cpu_count() or 4
+    return min(8, max(2, cpu_count // 2))
+
+
+def get_amp_dtype(device: torch.device):
+    # automatic mixed precision is only available in newer versions of torch
+    if device.type != "cuda" or not hasattr(torch, "autocast"):
+        return None
+    amp_dtype = flags.FLAGS.amp_dtype
+    if amp_dtype is None:
+        # bfloat16 is only natively supported from the Ampere architecture on,
+        # older GPUs would emulate it slower than float16
+        amp_dtype = (
+            "bf16" if torch.cuda.get_device_capability(device)[0] >= 8 else "fp16"
+        )
+    return {"bf16": torch.bfloat16, "fp16": torch.float16, "fp32": None}[amp_dtype]
+
+
+def compile_model(
+    model: torch.nn.Module, device: torch.device, samples, amp_dtype=None
+) -> torch.nn.Module:
+    # torch.compile is only available in newer versions of torch
+    if not hasattr(torch, "compile"):
+        print("torch.compile is not available, training without compiling the model")
+        return model
+    try:
+        import torch._dynamo  # pylint: disable=import-outside-toplevel
+
+        # allow some recompiles for the varying input image sizes
+        torch._dynamo.config.cache_size_limit = 64
+        # fall back to eager for graphs that fail to recompile later on, such as
+        # for new image sizes or evaluation
+        torch._dynamo.config.suppress_errors = True
+        compiled_model = torch.compile(model, mode="max-autotune", dynamic=False)
+        # torch.compile is lazy, run a training step so that compilation happens
+        # here and any failure falls back to the eager model
+        warm_up_model(compiled_model, device, samples, amp_dtype)
+        return compiled_model
+    except Exception as e:  # pylint: disable=broad-except
+        print("Failed to compile the model, training without compiling: %s" % e)
+        model.zero_grad()
+        return model
+
+
+def get_multi_tensor_optimizer_kwargs(optimizer_class, device: torch.device) -> dict:
+    # update all of the parameters with a few multi tensor kernels instead of one
+    # kernel launch per parameter, when supported by the installed torch
+    optimizer_params = inspect.signature(optimizer_class).parameters
+    if device.type == "cuda" and "fused" in optimizer_params:
+        return {"fused": True}
+    if "foreach" in optimizer_params:
+        return {"foreach": True}
+    return {}
+
+
+def warm_up_model(model, device: torch.device, samples, amp_dtype=None) -> None:
+    # Run one training step's forward and backward pass on a batch of samples so
+    # the CUDA context set up and cuDNN algorithm search are not counted in the
+    # first epoch
+    model.train()
+    # keep batch norm statistics from being updated by the warm up samples
+    for module in model.modules():
+        if isinstance(module, torch.nn.modules.batchnorm._BatchNorm):
+            module.eval()
+    images, targets = collate_detection_batch(samples).to_device_lists(device)
+    if amp_dtype is not None:
+        with torch.autocast(device_type=device.type, dtype=amp_dtype):
+            loss_dict = model(images, targets)
+    else:
+        loss_dict = model(images, targets)
+    sum(loss for loss in loss_dict.values()).backward()
+    model.zero_grad()
+    if device.type != "cuda":
+        return
+    torch.cuda.synchronize()
+    torch.cuda.empty_cache()
+    # so the max memory logged in the first epoch reflects training
+    if hasattr(torch.cuda, "reset_peak_memory_stats"):
+        torch.cuda.reset_peak_memory_stats()
+    else:
+        torch.cuda.reset_max_memory_allocated()
+
+
+def get_grad_scaler():
+    # torch.cuda.amp.GradScaler is deprecated in newer versions of torch
+    if hasattr(torch, "amp") and hasattr(torch.amp, "GradScaler"):
+        return torch.amp.GradScaler("cuda")
+    return torch.cuda.amp.GradScaler()
+
+
+def get_data_loader_kwargs(num_workers: int) -> dict:
+    kwargs = {
+        "num_workers": num_workers,
+        "collate_fn": collate_detection_batch,
+        # pinned host memory lets the image copies to the GPU run asynchronously
+        "pin_memory": torch.cuda.is_available(),
+    }
+    # prefetch_factor and persistent_workers are only available in newer
+    # versions of torch and only valid when using worker processes
+    loader_params = inspect.signature(torch.utils.data.DataLoader).parameters
+    if num_workers > 0 and "persistent_workers" in loader_params:
+        kwargs["prefetch_factor"] = 4
+        kwargs["persistent_workers"] = True
+    return kwargs
+
+
+def save_evaluation_chart(
+    average_precision, average_recall, title: str, file_path: str
+) -> None:
+    # matplotlib is only needed at the end of training, so it is imported here to
+    # keep it out of the start up time
+    import matplotlib  # pylint: disable=import-outside-toplevel
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt  # pylint: disable=import-outside-toplevel
+
+    fig, ax = plt.subplots(figsize=(6.4, 4.8), dpi=72)
+    ax.plot(average_precision, label="AP: IoU=0.50:0.95 maxDets=100")
+    ax.plot(average_recall, label="AR: IoU=0.50:0.95 maxDets=100")
+    ax.legend(loc="lower right")
+    ax.set_title(title)
+    fig.savefig(file_path)
+    plt.close(fig)
+
+
+def stratified_split(
+    dataset: BojaDataSet, test_fraction: float, rng: np.random.Generator
+) -> Tuple[List[int], List[int]]:
+    """Split the dataset indices into train and test indices, stratified by the
+    rarest class in each image.
+
+    The test set always holds round(test_fraction * N) images, at least one,
+    shared out across the strata by largest remainder so that each class is
+    represented in proportion as far as that count allows. When fewer than two
+    strata have more than one image a plain seeded permutation is used instead.
+    """
+    num_images = len(dataset)
+    if num_images < 2:
+        return list(range(num_images)), []
+    num_test = min(max(int(round(test_fraction * num_images)), 1), num_images - 1)
+
+    image_labels = [set(dataset.get_labels(i)) for i in range(num_images)]
+    label_counts = Counter(label for labels in image_labels for label in labels)
+    strata = np.array(
+        [min(labels, key=lambda l: (label_counts[l], l)) for labels in image_labels]
+    )
+    stratum_values, stratum_sizes = np.unique(strata, return_counts=True)
+
+    if np.count_nonzero(stratum_sizes > 1) < 2:
+        indices = rng.permutation(num_images)
+        return indices[num_test:].tolist(), indices[:num_test].tolist()
+
+    # largest remainder allocation of the test images, ties broken at random
+    quotas = num_test * stratum_sizes / num_images
+    stratum_num_test = np.floor(quotas).astype(int)
+    remainders = quotas - stratum_num_test
+    order = rng.permutation(len(stratum_values))
+    order = order[np.argsort(-remainders[order], kind="stable")]
+    stratum_num_test[order[: num_test - stratum_num_test.sum()]] += 1
+
+    train_indices = []
+    test_indices = []
+    for stratum, stratum_test in zip(stratum_values, stratum_num_test):
+        stratum_indices = rng.permutation(np.flatnonzero(strata == stratum))
+        test_indices.extend(stratum_indices[:stratum_test].tolist())
+        train_indices.extend(stratum_indices[stratum_test:].tolist())
+    return train_indices, test_indices
+
+
 def get_newest_manifest_path(manifest_dir_path: str) -> str:
     return get_highest_numbered_file(manifest_dir_path, MANIFEST_FILE_TYPE)
 
@@ -79,6 +299,30 @@ def main(unused_argv):
 
     start_time = int(time.time())
 
+    local_image_dir = os.path.join(flags.FLAGS.local_data_dir, IMAGE_DIR_NAME)
+    local_annotation_dir = os.path.join(flags.FLAGS.local_data_dir, ANNOTATION_DIR_NAME)
+    local_manifest_dir = os.path.join(flags.FLAGS.local_data_dir, MANIFEST_DIR_NAME)
+    local_model_state_dir = os.path.join(
+        flags.FLAGS.local_data_dir, MODEL_STATE_DIR_NAME
+    )
+    local_logs_dir = os.path.join(flags.FLAGS.local_data_dir, LOGS_DIR_NAME)
+
+    # the label file is not synced from s3, check it before downloading anything
+    label_file_path = os.path.join(flags.FLAGS.local_data_dir, LABEL_FILE_NAME)
+    if not os.path.isfile(label_file_path):
+        print("Missing file %s" % label_file_path)
+        return 1
+
+    # read in the category labels
+    labels = Path(label_file_path).read_text().splitlines()
+
+    if len(labels) == 0:
+        print("No label categories found in %s" % label_file_path)
+        return 1
+
+    # add the background class
+    labels = ["background"] + labels
+
     use_s3 = True if flags.FLAGS.s3_bucket_name is not None else False
 
     if use_s3:
@@ -95,180 +339,253 @@ def main(unused_argv):
             )
 
     if use_s3:
-        # Download any new images from s3
-        s3_download_dir(
-            flags.FLAGS.s3_bucket_name,
-            "/".join([flags.FLAGS.s3_data_dir, IMAGE_DIR_NAME]),
-            os.path.join(flags.FLAGS.local_data_dir, IMAGE_DIR_NAME),
-            IMAGE_FILE_TYPE,
-        )
-
-        # Download any new annotation files from s3
-        s3_download_dir(
-            flags.FLAGS.s3_bucket_name,
-            "/".join([flags.FLAGS.s3_data_dir, ANNOTATION_DIR_NAME]),
-            os.path.join(flags.FLAGS.local_data_dir, ANNOTATION_DIR_NAME),
-            ANNOTATION_FILE_TYPE,
-        )
-
-        # Download any new manifests files from s3
-        s3_download_dir(
-            flags.FLAGS.s3_bucket_name,
-            "/".join([flags.FLAGS.s3_data_dir, MANIFEST_DIR_NAME]),
-            os.path.join(flags.FLAGS.local_data_dir, MANIFEST_DIR_NAME),
-            MANIFEST_FILE_TYPE,
-        )
-
-    label_file_path = os.path.join(flags.FLAGS.local_data_dir, LABEL_FILE_NAME)
-    if not os.path.isfile(label_file_path):
-        print("Missing file %s" % label_file_path)
-        return
-
-    # read in the category labels
-    labels = open(label_file_path).read().splitlines()
-
-    if len(labels) == 0:
-        print("No label categories found in %s" % label_file_path)
-        return
-
-    # add the background class
-    labels.insert(0, "background")
+        # Download any new images, annotation files and manifests from s3
+        download_args = [
+            (
+                flags.FLAGS.s3_bucket_name,
+                "/".join([flags.FLAGS.s3_data_dir, dir_name]),
+                local_dir,
+                file_type,
+            )
+            for dir_name, local_dir, file_type in [
+                (IMAGE_DIR_NAME, local_image_dir, IMAGE_FILE_TYPE),
+                (ANNOTATION_DIR_NAME, local_annotation_dir, ANNOTATION_FILE_TYPE),
+                (MANIFEST_DIR_NAME, local_manifest_dir, MANIFEST_FILE_TYPE),
+            ]
+        ]
+        with ThreadPoolExecutor(max_workers=len(download_args)) as executor:
+            list(executor.map(lambda args: s3_download_dir(*args), download_args))
 
-    newest_manifest_file = get_newest_manifest_path(
-        os.path.join(flags.FLAGS.local_data_dir, MANIFEST_DIR_NAME)
-    )
+    newest_manifest_file = get_newest_manifest_path(local_manifest_dir)
 
     if newest_manifest_file is None:
-        print(
-            "Cannot find a manifest file in: %s"
-            % (os.path.join(flags.FLAGS.local_data_dir, MANIFEST_DIR_NAME))
-        )
+        print("Cannot find a manifest file in: %s" % local_manifest_dir)
+        return 1
 
     # train on the GPU or on the CPU, if a GPU is not available
     device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
 
     print("Using device: ", device)
 
+    if device.type == "cuda":
+        # let cuDNN pick the fastest convolution algorithms for the input sizes
+        torch.backends.cudnn.benchmark = True
+
     num_classes = len(labels)
-    # use our dataset and defined transformations
 
-    dataset = BojaDataSet(
-        os.path.join(flags.FLAGS.local_data_dir, IMAGE_DIR_NAME),
-        os.path.join(flags.FLAGS.local_data_dir, ANNOTATION_DIR_NAME),
+    # load the dataset once, the train and test sets only differ in transformations.
+    # The annotation files are read in the background while the model is set up.
+    dataset_executor = ThreadPoolExecutor(max_workers=1)
+    dataset_future = dataset_executor.submit(
+        BojaDataSet,
+        local_image_dir,
+        local_annotation_dir,
         newest_manifest_file,
-        get_transform(train=True),
+        None,
         labels,
     )
 
-    dataset_test = BojaDataSet(
-        os.path.join(flags.FLAGS.local_data_dir, IMAGE_DIR_NAME),
-        os.path.join(flags.FLAGS.local_data_dir, ANNOTATION_DIR_NAME),
-        newest_manifest_file,
-        get_transform(train=False),
-        labels,
-    )
+    # get the model using our helper function
+    model = _models.__dict__[flags.FLAGS.network](num_classes)
 
-    # split the dataset in train and test set
-    indices = torch.randperm(len(dataset)).tolist()
+    # move model to the right device, channels last memory format is faster for
+    # convolutions on tensor cores
+    if device.type == "cuda" and hasattr(torch, "channels_last"):
+        model = model.to(device, memory_format=torch.channels_last)
+    else:
+        model.to(device)
+
+    dataset_base = dataset_future.result()
+    dataset_executor.shutdown()
+
+    if flags.FLAGS.cache_images:
+        image_cache_dir = os.path.join(flags.FLAGS.local_data_dir, IMAGE_CACHE_DIR_NAME)
+        create_output_dir(image_cache_dir)
+        image_cache_path = os.path.join(
+            image_cache_dir,
+            "%s.%s"
+            % (
+                os.path.splitext(os.path.basename(newest_manifest_file))[0],
+                IMAGE_CACHE_FILE_TYPE,
+            ),
+        )
+        # only the images the dataset kept after filtering are cached
+        create_image_cache(dataset_base.images, image_cache_path)
+        dataset_base.set_image_cache(image_cache_path)
 
+    # split the dataset in train and test set, seeded by the run's start time.
     # use 20 percent of the dataset for testing
-    num_test = int(0.2 * len(dataset))
+    train_indices, test_indices = stratified_split(
+        dataset_base, 0.2, np.random.default_rng(seed=start_time)
+    )
 
-    dataset = torch.utils.data.Subset(dataset, indices[: -1 * num_test])
-    dataset_test = torch.utils.data.Subset(dataset_test, indices[-1 * num_test :])
+    dataset = TransformedSubset(dataset_base, train_indices, get_transform(train=True))
+    dataset_test = TransformedSubset(
+        dataset_base, test_indices, get_transform(train=False)
+    )
 
     print(
         "Training dataset size: %d, Testing dataset size: %d"
         % (len(dataset), len(dataset_test))
     )
 
+    if len(dataset) == 0 or len(dataset_test) == 0:
+        print("Need at least 2 annotated images to train and evaluate")
+        return 1
+
     # define training and validation data loaders
     # data_loader = torch.utils.data.DataLoader(
     #     dataset, batch_size=2, shuffle=True, num_workers=4, collate_fn=utils.collate_fn
     # )
 
-    data_loader = torch.utils.data.DataLoader(
-        dataset, batch_size=1, shuffle=True, num_workers=1, collate_fn=collate_fn
+    num_workers = get_num_workers()
+    print("Using %d data loading workers" % num_workers)
+
+    train_sampler = torch.utils.data.RandomSampler(dataset)
+    if flags.FLAGS.aspect_ratio_group_factor >= 0:
+        group_ids = create_aspect_ratio_groups(
+            dataset, k=flags.FLAGS.aspect_ratio_group_factor
+        )
+        train_batch_sampler = GroupedBatchSampler(
+            train_sampler, group_ids, flags.FLAGS.batch_size
+        )
+    else:
+        train_batch_sampler = torch.utils.data.BatchSampler(
+            train_sampler, flags.FLAGS.batch_size, drop_last=False
+        )
+
+    data_loader = PrefetchDataLoader(
+        dataset,
+        batch_sampler=train_batch_sampler,
+        **get_data_loader_kwargs(num_workers)
     )
 
     data_loader_test = torch.utils.data.DataLoader(
-        dataset_test, batch_size=1, shuffle=False, num_workers=1, collate_fn=collate_fn,
+        dataset_test, batch_size=1, shuffle=False, **get_data_loader_kwargs(num_workers)
     )
 
-    # get the model using our helper function
-    model = _models.__dict__[flags.FLAGS.network](num_classes)
-
-    # move model to the right device
-    model.to(device)
+    amp_dtype = get_amp_dtype(device)
+    # float16 gradients need to be scaled to avoid underflow, bfloat16 ones do not
+    scaler = get_grad_scaler() if amp_dtype == torch.float16 else None
+    if amp_dtype is not None:
+        print("Training with mixed precision: ", amp_dtype)
 
     # construct an optimizer
     params = [p for p in model.parameters() if p.requires_grad]
-    optimizer = torch.optim.SGD(params, lr=0.005, momentum=0.9, weight_decay=0.0005)
+    optimizer = torch.optim.SGD(
+        params,
+        lr=0.005,
+        momentum=0.9,
+        weight_decay=0.0005,
+        **get_multi_tensor_optimizer_kwargs(torch.optim.SGD, device)
+    )
+    # setting gradients to None instead of zero skips a kernel per parameter
+    set_grads_to_none = (
+        "set_to_none" in inspect.signature(optimizer.zero_grad).parameters
+    )
     # and a learning rate scheduler
     lr_scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=3, gamma=0.1)
 
+    # warm up with a full training batch so its shape matches the first epoch's
+    warm_up_samples = [
+        dataset[i] for i in range(min(len(dataset), flags.FLAGS.batch_size))
+    ]
+    # keep a reference to the uncompiled model so the saved state dict keys match
+    # the ones expected when loading the model state for prediction
+    model_without_compile = model
+    if flags.FLAGS.compile_model and len(warm_up_samples) > 0:
+        print("Compiling the model")
+        model = compile_model(model, device, warm_up_samples, amp_dtype)
+    elif device.type == "cuda" and len(warm_up_samples) > 0:
+        print("Warming up the model")
+        warm_up_model(model, device, warm_up_samples, amp_dtype)
+
     num_epochs = flags.FLAGS.num_epochs
 
     print("Training for %d epochs" % num_epochs)
 
-    average_persision = []
-    average_recall = []
+    average_persision = np.empty(num_epochs, dtype=np.float32)
+    average_recall = np.empty_like(average_persision)
 
     for epoch in range(num_epochs):
         # train for one epoch, printing every 10 iterations
-        train_one_epoch(model, optimizer, data_loader, device, epoch, print_freq=10)
+        train_one_epoch(
+            model,
+            optimizer,
+            data_loader,
+            device,
+            epoch,
+            print_freq=10,
+            amp_dtype=amp_dtype,
+            scaler=scaler,
+            set_grads_to_none=set_grads_to_none,
+        )
         # update the learning rate
         lr_scheduler.step()
+        # start loading the next epoch's training data while evaluating, only with
+        # worker processes, a loading thread would compete with evaluation for the GIL
+        if epoch < num_epochs - 1 and data_loader.num_workers > 0:
+            data_loader.prefetch()
         # evaluate on the test dataset
         eval_data = evaluate(model, data_loader_test, device=device)
 
         stats = eval_data.coco_eval["bbox"].stats
-        average_persision.append(stats[AVERAGE_PRECISION_STAT_INDEX])
-        average_recall.append(stats[AVERAGE_RECALL_STAT_INDEX])
+        average_persision[epoch] = stats[AVERAGE_PRECISION_STAT_INDEX]
+        average_recall[epoch] = stats[AVERAGE_RECALL_STAT_INDEX]
 
-    model_state_local_dir = os.path.join(
-        flags.FLAGS.local_data_dir, MODEL_STATE_DIR_NAME
-    )
     # Create model state directory if it does not exist yet
-    create_output_dir(model_state_local_dir)
+    create_output_dir(local_model_state_dir)
     run_name = "%s-%s" % (str(start_time), flags.FLAGS.network)
 
     model_state_file_path = os.path.join(
-        model_state_local_dir, "%s.%s" % (run_name, MODEL_STATE_FILE_TYPE),
+        local_model_state_dir, "%s.%s" % (run_name, MODEL_STATE_FILE_TYPE),
     )
 
     # Save the model state to a file
-    torch.save(model.state_dict(), model_state_file_path)
+    # the zipfile format is only optional in some versions of torch, and the default
+    # in newer ones
+    save_kwargs = {}
+    if "_use_new_zipfile_serialization" in inspect.signature(torch.save).parameters:
+        save_kwargs["_use_new_zipfile_serialization"] = True
+    torch.save(model_without_compile.state_dict(), model_state_file_path, **save_kwargs)
 
     print("Model state saved at: %s" % model_state_file_path)
 
-    plt.plot(average_persision, label="AP: IoU=0.50:0.95 maxDets=100")
-    plt.plot(average_recall, label="AR: IoU=0.50:0.95 maxDets=100")
-    plt.legend(loc="lower right")
-    plt.title("Evaluation data from %s" % run_name)
+    upload_executor = ThreadPoolExecutor(max_workers=2)
+    if use_s3:
+        # Send the saved model to S3 while the log chart is created
+        model_upload = upload_executor.submit(
+            s3_upload_files,
+            flags.FLAGS.s3_bucket_name,
+            [model_state_file_path],
+            "/".join([flags.FLAGS.s3_data_dir, MODEL_STATE_DIR_NAME]),
+        )
 
     # Create log file directory if it does not exist yet
-    log_image_local_dir = os.path.join(flags.FLAGS.local_data_dir, LOGS_DIR_NAME)
-    create_output_dir(log_image_local_dir)
+    create_output_dir(local_logs_dir)
 
     log_file_name = "%s.jpg" % run_name
-    log_file_path = os.path.join(log_image_local_dir, log_file_name)
-    plt.savefig(log_file_path)
+    log_file_path = os.path.join(local_logs_dir, log_file_name)
+    save_evaluation_chart(
+        average_persision,
+        average_recall,
+        "Evaluation data from %s" % run_name,
+        log_file_path,
+    )
 
     print("Log file saved at: %s" % log_file_path)
 
     if use_s3:
-        # Send the saved model and logs to S3
-        s3_upload_files(
-            flags.FLAGS.s3_bucket_name,
-            [model_state_file_path],
-            "/".join([flags.FLAGS.s3_data_dir, MODEL_STATE_DIR_NAME]),
-        )
-        s3_upload_files(
+        # Send the saved logs to S3 alongside the model
+        logs_upload = upload_executor.submit(
+            s3_upload_files,
             flags.FLAGS.s3_bucket_name,
             [log_file_path],
             "/".join([flags.FLAGS.s3_data_dir, LOGS_DIR_NAME]),
         )
+        model_upload.result()
+        logs_upload.result()
+    upload_executor.shutdown()
 
     print("Training complete")
 
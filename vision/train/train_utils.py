@@ -4,6 +4,8 @@ from __future__ import print_function
 from collections import defaultdict, deque
 import datetime
 import pickle
+import queue
+import threading
 import time
 
 import torch
@@ -256,10 +258,107 @@ class MetricLogger(object):
         )
 
 
+class BackgroundGenerator(threading.Thread):
+    """Consume an iterator on a background thread, buffering up to
+    max_prefetch items so the consumer does not wait on loading.
+    """
+
+    _END = object()
+
+    def __init__(self, iterator, max_prefetch=4):
+        super(BackgroundGenerator, self).__init__(daemon=True)
+        self.queue = queue.Queue(max_prefetch)
+        self.iterator = iterator
+        self.exception = None
+        self.start()
+
+    def run(self):
+        try:
+            for item in self.iterator:
+                self.queue.put(item)
+        except Exception as e:  # pylint: disable=broad-except
+            # re-raised on the consuming thread
+            self.exception = e
+        finally:
+            self.queue.put(self._END)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = self.queue.get()
+        if item is self._END:
+            if self.exception is not None:
+                raise self.exception
+            raise StopIteration
+        return item
+
+
+class PrefetchDataLoader(torch.utils.data.DataLoader):
+    """DataLoader that loads batches on a background thread. Calling
+    prefetch() starts loading the next pass over the data before it is
+    iterated, e.g. while the model is being evaluated.
+    """
+
+    max_prefetch = 4
+
+    def prefetch(self):
+        self._prefetched = BackgroundGenerator(
+            super(PrefetchDataLoader, self).__iter__(), self.max_prefetch
+        )
+
+    def __iter__(self):
+        prefetched = getattr(self, "_prefetched", None)
+        if prefetched is None:
+            return BackgroundGenerator(
+                super(PrefetchDataLoader, self).__iter__(), self.max_prefetch
+            )
+        self._prefetched = None
+        return prefetched
+
+
 def collate_fn(batch):
     return tuple(zip(*batch))
 
 
+class DetectionBatch(object):
+    """A batch of images and targets where each target field is concatenated
+    across the batch into one tensor, so it can be pinned and copied to the
+    device in one transfer instead of one per image.
+    """
+
+    def __init__(self, images, targets):
+        self.images = list(images)
+        self.keys = list(targets[0].keys()) if len(targets) > 0 else []
+        self.split_sizes = {k: [len(t[k]) for t in targets] for k in self.keys}
+        self.fields = {k: torch.cat([t[k] for t in targets]) for k in self.keys}
+
+    def pin_memory(self):
+        self.images = [image.pin_memory() for image in self.images]
+        self.fields = {k: v.pin_memory() for k, v in self.fields.items()}
+        return self
+
+    def to_device_lists(self, device, non_blocking=False):
+        """Copy the batch to device and return it as a list of images and a list
+        of per image target dicts.
+        """
+        images = [image.to(device, non_blocking=non_blocking) for image in self.images]
+        fields = {
+            k: v.to(device, non_blocking=non_blocking).split(self.split_sizes[k])
+            for k, v in self.fields.items()
+        }
+        targets = [{k: fields[k][i] for k in self.keys} for i in range(len(images))]
+        return images, targets
+
+    def __len__(self):
+        return len(self.images)
+
+
+def collate_detection_batch(batch):
+    images, targets = zip(*batch)
+    return DetectionBatch(images, targets)
+
+
 def warmup_lr_scheduler(optimizer, warmup_iters, warmup_factor):
     def f(x):
         if x >= warmup_iters: